@@ -0,0 +1,58 @@
+import asyncio
+from collections import deque
+
+
+class _Message:
+    __slots__ = ("handler", "args", "key", "merge", "future")
+
+    def __init__(self, handler, args, key, merge, future):
+        self.handler = handler
+        self.args = args
+        self.key = key
+        self.merge = merge
+        self.future = future
+
+
+# Runs one guild's mutations in order, on a task that only exists while there is work queued.
+# A message posted with the same key as the last one still waiting is folded into it with
+# merge(old_args, new_args), so a burst of identical commands runs once.
+class Mailbox:
+    def __init__(self):
+        self._messages = deque()
+        self._runner = None
+
+    @property
+    def busy(self):
+        return self._runner is not None and not self._runner.done()
+
+    def post(self, handler, *args, key=None, merge=None):
+        if key is not None and self._messages and self._messages[-1].key == key:
+            last = self._messages[-1]
+            last.args = last.merge(last.args, args)
+            return last.future
+
+        loop = asyncio.get_event_loop()
+        message = _Message(handler, args, key, merge or (lambda old, new: new), loop.create_future())
+        self._messages.append(message)
+
+        if not self.busy:
+            self._runner = loop.create_task(self._run())
+
+        return message.future
+
+    def clear(self):
+        while self._messages:
+            self._messages.popleft().future.cancel()
+
+    async def _run(self):
+        while self._messages:
+            message = self._messages.popleft()
+
+            try:
+                result = await message.handler(*message.args)
+            except Exception as exc:
+                if not message.future.done():
+                    message.future.set_exception(exc)
+            else:
+                if not message.future.done():
+                    message.future.set_result(result)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+DB_PATH = "data/analytics.sqlite3"
+FLUSH_INTERVAL = 30.0
+FLUSH_SIZE = 500
+RETENTION = 30 * 24 * 60 * 60
+
+PLAY = "play"
+SKIP = "skip"
+SEARCH = "search"
+
+
+# Events are only appended to an in-memory buffer on the hot path. Batches are written on a worker thread
+# as one compressed row each, and per-track play/skip counts are rolled up in the same transaction so
+# queries never scan raw events.
+class EventLog:
+    def __init__(self, path=DB_PATH, flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._buffer = []
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+        self._flusher = None
+
+    def record(self, kind, guild_id, track=None, query=None):
+        self._buffer.append((
+            time.time(), kind, guild_id,
+            getattr(track, "identifier", None), getattr(track, "title", None), query
+        ))
+
+        if len(self._buffer) >= self.flush_size:
+            asyncio.get_event_loop().create_task(self._flush_logged())
+
+    def start(self, loop):
+        self._flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Could not flush play history.")
+
+    async def flush(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            await asyncio.get_event_loop().run_in_executor(self._executor, self._write, batch)
+
+    async def top_tracks(self, guild_id, limit=10):
+        await self.flush()
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._top_tracks, guild_id, limit)
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+
+        batch, self._buffer = self._buffer, []
+        self._executor.submit(self._write, batch)
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS event_batches ("
+                "id INTEGER PRIMARY KEY, first_at REAL NOT NULL, last_at REAL NOT NULL, "
+                "count INTEGER NOT NULL, events BLOB NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS track_rollups ("
+                "guild_id INTEGER NOT NULL, identifier TEXT NOT NULL, title TEXT NOT NULL, "
+                "plays INTEGER NOT NULL DEFAULT 0, skips INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (guild_id, identifier));"
+                "CREATE INDEX IF NOT EXISTS track_rollups_plays ON track_rollups (guild_id, plays DESC);"
+            )
+
+        return self._db
+
+    def _write(self, batch):
+        if not batch:
+            return
+
+        db = self._connect()
+        counts = {}
+        for _, kind, guild_id, identifier, title, _ in batch:
+            if kind in (PLAY, SKIP) and identifier is not None:
+                entry = counts.setdefault((guild_id, identifier), [title, 0, 0])
+                entry[1 if kind == PLAY else 2] += 1
+
+        with db:
+            db.execute(
+                "INSERT INTO event_batches (first_at, last_at, count, events) VALUES (?, ?, ?, ?)",
+                (batch[0][0], batch[-1][0], len(batch), zlib.compress(json.dumps(batch).encode("utf-8")))
+            )
+            db.executemany(
+                "INSERT INTO track_rollups (guild_id, identifier, title, plays, skips) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, identifier) DO UPDATE SET "
+                "title = excluded.title, plays = plays + excluded.plays, skips = skips + excluded.skips",
+                [(g, i, title or i, plays, skips) for (g, i), (title, plays, skips) in counts.items()]
+            )
+            db.execute("DELETE FROM event_batches WHERE last_at < ?", (time.time() - RETENTION,))
+
+    def _top_tracks(self, guild_id, limit):
+        return self._connect().execute(
+            "SELECT title, plays, skips FROM track_rollups WHERE guild_id = ? ORDER BY plays DESC LIMIT ?",
+            (guild_id, limit)
+        ).fetchall()
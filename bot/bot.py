@@ -1,12 +1,32 @@
+import base64
+import binascii
+import logging
 from pathlib import Path
 
 import discord
 from discord.ext import commands
 
+from .log import setup_logging
+from .startup import StartupTimer
+
+log = logging.getLogger(__name__)
+
+
+def token_user_id(token):
+    # The first segment of a bot token is the bot's user ID in base64.
+    head = token.strip().split(".")[0]
+    try:
+        return int(base64.b64decode(head + "=" * (-len(head) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+
 
 class MusicBot(commands.Bot):
     def __init__(self):
         self._cogs = [p.stem for p in Path(".").glob("./bot/cogs/*.py")]
+        self._log_writer = None
+        self.startup = StartupTimer("gateway", "node")
+        self.user_id_hint = None
         super().__init__(
             command_prefix=self.prefix, 
             case_insensitive=True,
@@ -14,39 +34,49 @@ class MusicBot(commands.Bot):
             )
 
     def setup(self):
-        print(" Running RainyServices™...")
+        log.info("Running RainyServices™...")
 
         for cog in self._cogs:
             self.load_extension(f"bot.cogs.{cog}")
-            print(f" Loaded `{cog}` cog.")
+            self.startup.mark(f"load {cog} cog")
+            log.info("Loaded `%s` cog.", cog)
 
-        print(" RainyServices™ setup complete.")
+        log.info("RainyServices™ setup complete.")
 
     def run(self):
-        self.setup()
+        self._log_writer = setup_logging()
+        self.startup.mark("logging")
 
         with open("data/token.txt", "r", encoding="utf-8") as f:
             TOKEN = f.read()
 
-        print(" Running RainyMusic™...")
-        super().run(TOKEN, reconnect=True)
+        self.user_id_hint = token_user_id(TOKEN)
+        self.startup.mark("read token")
+        self.setup()
+
+        log.info("Running RainyMusic™...")
+        try:
+            super().run(TOKEN, reconnect=True)
+        finally:
+            self._log_writer.stop()
 
     async def shutdown(self):
-        print(" Closing RainyServices™'s connection to Discord...")
+        log.info("Closing RainyServices™'s connection to Discord...")
         await super().close()
 
     async def close(self):
-        print(" Closing RainyServices™ on keyboard interrupt...")
+        log.info("Closing RainyServices™ on keyboard interrupt...")
         await self.shutdown()
 
     async def on_connect(self):
-        print(f" RainyServices™ is connected to Discord (latency: {self.latency*1000:,.0f} ms).")
+        self.startup.mark("gateway connect")
+        log.info("RainyServices™ is connected to Discord (latency: %s ms).", f"{self.latency*1000:,.0f}")
 
     async def on_resumed(self):
-        print(" RainyMusic™ is resumed.")
+        log.info("RainyMusic™ is resumed.")
 
     async def on_disconnect(self):
-        print(" RainyMusic™ is disconnected.")
+        log.warning("RainyMusic™ is disconnected.")
 
     async def on_error(self, err, *args, **kwargs):
         raise
@@ -55,8 +85,9 @@ class MusicBot(commands.Bot):
         raise getattr(exc, "original", exc)
 
     async def on_ready(self):
+        self.startup.done("gateway")
         self.client_id = (await self.application_info()).id
-        print(" RainyMusic™ is ready.")
+        log.info("RainyMusic™ is ready.")
 
     async def prefix(self, bot, msg):
         return commands.when_mentioned_or("r!")(bot, msg)
@@ -65,6 +96,10 @@ class MusicBot(commands.Bot):
         ctx = await self.get_context(msg, cls=commands.Context)
 
         if ctx.command is not None:
+            log.info(
+                "Command invoked.",
+                extra={"guild": getattr(ctx.guild, "id", None), "command": ctx.command.qualified_name}
+            )
             await self.invoke(ctx)
 
     async def on_message(self, msg):
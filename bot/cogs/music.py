@@ -1,16 +1,30 @@
 import asyncio
 import datetime as dt
 import enum
+import functools
+import json
+import logging
 import random
 import re
+import time
 import typing as t
+from collections import Counter, deque
 from enum import Enum
+from urllib.parse import urlparse
 
 import aiohttp
 import discord
 import wavelink
 from discord.ext import commands
 
+from .. import render
+from ..actor import Mailbox
+from ..analytics import PLAY, SEARCH, SKIP, EventLog
+from ..prompts import PromptRegistry
+from ..scheduler import Priority, RequestScheduler
+
+log = logging.getLogger(__name__)
+
 URL_REGEX = r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))"
 LYRICS_URL = "https://some-random-api.ml/lyrics?title="
 HZ_BANDS = (20, 40, 63, 100, 150, 250, 400, 450, 630, 1000, 1600, 2500, 4000, 10000, 16000)
@@ -22,6 +36,21 @@ OPTIONS = {
     "4⃣": 3,
     "5⃣": 4,
 }
+RETRY_BACKOFF = 0.25
+RECOVERY_BUDGET = 1.0
+PREPARE_TIMEOUT = 10.0
+HEALTH_WINDOW = 300.0
+HEALTH_PROBE_INTERVAL = 30.0
+FALLBACK_SEARCHES = {
+    "ytsearch": "youtube",
+    "scsearch": "soundcloud",
+}
+AUTOPLAY_POOL = 5
+AUTOPLAY_LOW = 2
+AUTOPLAY_SEEDS = 3
+AUTOPLAY_WAIT = 5.0
+YOUTUBE_MIX_URL = "https://www.youtube.com/watch?v={0}&list=RD{0}"
+PERMANENT_ERRORS = ("unavailable", "private", "removed", "copyright", "blocked", "not available", "age")
 
 
 class AlreadyConnectedToChannel(commands.CommandError):
@@ -92,17 +121,189 @@ class InvalidTimeString(commands.CommandError):
     pass
 
 
+class InvalidQueueIndex(commands.CommandError):
+    pass
+
+
+class CurrentTrackLocked(commands.CommandError):
+    pass
+
+
+class AlreadyQueued(commands.CommandError):
+    pass
+
+
+class NoSuchPlaylist(commands.CommandError):
+    pass
+
+
+class InvalidPlaylistScope(commands.CommandError):
+    pass
+
+
 class RepeatMode(Enum):
     NONE = 0
     ONE = 1
     ALL = 2
 
 
+class Failure(Enum):
+    STUCK = 0
+    TRANSIENT = 1
+    PERMANENT = 2
+
+    @classmethod
+    def classify(cls, payload):
+        if isinstance(payload, wavelink.events.TrackStuck):
+            return cls.STUCK
+
+        error = str(getattr(payload, "error", "") or "").lower()
+        if any(word in error for word in PERMANENT_ERRORS):
+            return cls.PERMANENT
+
+        return cls.TRANSIENT
+
+    @property
+    def retryable(self):
+        return self is not Failure.PERMANENT
+
+
+def source_of(track):
+    if source := track.info.get("sourceName"):
+        return source
+
+    host = urlparse(track.info.get("uri") or "").netloc.lower()
+    if "youtu" in host:
+        return "youtube"
+    elif "soundcloud" in host:
+        return "soundcloud"
+
+    return host or "unknown"
+
+
+class VoicePresence:
+    def __init__(self):
+        self._humans = {}
+
+    def seed(self, guilds):
+        self._humans = {}
+
+        for guild in guilds:
+            self.seed_guild(guild)
+
+    def seed_guild(self, guild):
+        for channel in guild.voice_channels + guild.stage_channels:
+            self.recount(channel)
+
+    def forget_guild(self, guild):
+        for channel in guild.voice_channels + guild.stage_channels:
+            self._humans.pop(channel.id, None)
+
+    def recount(self, channel):
+        if count := sum(not m.bot for m in channel.members):
+            self._humans[channel.id] = count
+        else:
+            self._humans.pop(channel.id, None)
+
+        return count
+
+    def update(self, member, before, after):
+        if member.bot or before.channel == after.channel:
+            return
+
+        if before.channel is not None:
+            if (count := self._humans.get(before.channel.id, 0) - 1) > 0:
+                self._humans[before.channel.id] = count
+            else:
+                self._humans.pop(before.channel.id, None)
+
+        if after.channel is not None:
+            self._humans[after.channel.id] = self._humans.get(after.channel.id, 0) + 1
+
+    def humans(self, channel_id):
+        return self._humans.get(channel_id, 0)
+
+
+def track_id(track):
+    return track if isinstance(track, str) or track is None else getattr(track, "id", None)
+
+
+class SourceHealth:
+    def __init__(self, window=HEALTH_WINDOW, min_samples=5, threshold=0.6, probe_interval=HEALTH_PROBE_INTERVAL):
+        self._outcomes = {}
+        self._probed = {}
+        self.window = window
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+
+    def _recent(self, source):
+        if not (outcomes := self._outcomes.get(source)):
+            return ()
+
+        # Outcomes older than the window no longer count, so a source isn't written off for good.
+        cutoff = time.monotonic() - self.window
+        while outcomes and outcomes[0][0] < cutoff:
+            outcomes.popleft()
+
+        return outcomes
+
+    def _record(self, source, ok):
+        if source not in self._outcomes:
+            self._outcomes[source] = deque(maxlen=50)
+
+        self._outcomes[source].append((time.monotonic(), ok))
+
+    def record_success(self, source):
+        self._record(source, True)
+
+    def record_failure(self, source):
+        self._record(source, False)
+
+    def failure_rate(self, source):
+        if not (outcomes := self._recent(source)):
+            return 0.
+
+        return sum(not ok for _, ok in outcomes) / len(outcomes)
+
+    def is_bad(self, source):
+        return len(self._recent(source)) >= self.min_samples and self.failure_rate(source) >= self.threshold
+
+    def should_avoid(self, source):
+        if not self.is_bad(source):
+            return False
+
+        # Half-open: a bad source still gets a play through every probe interval, so it can prove itself again.
+        now = time.monotonic()
+        if now - self._probed.get(source, 0.) >= self.probe_interval:
+            self._probed[source] = now
+            return False
+
+        return True
+
+    def ranked_searches(self):
+        return sorted(
+            (prefix for prefix, source in FALLBACK_SEARCHES.items() if not self.is_bad(source)),
+            key=lambda prefix: self.failure_rate(FALLBACK_SEARCHES[prefix])
+        )
+
+
 class Queue:
     def __init__(self):
         self._queue = []
+        # Identifier -> number of queued copies. Positions shift on every edit, so they are resolved
+        # against the list itself; the index keeps membership and dedupe checks O(1).
+        self._index = Counter()
         self.position = 0
         self.repeat_mode = RepeatMode.NONE
+        self.auto_dedupe = False
+        # Bumped on every edit; rendered pages are kept until it or the position changes.
+        self.version = 0
+        self._pages = {}
+        self._pages_key = None
+
+    def __contains__(self, track):
+        return self._index[track.identifier] > 0
 
     @property
     def is_empty(self):
@@ -116,6 +317,11 @@ class Queue:
         if self.position <= len(self._queue) - 1:
             return self._queue[self.position]
 
+    @property
+    def next_track(self):
+        if self.position + 1 <= len(self._queue) - 1:
+            return self._queue[self.position + 1]
+
     @property
     def upcoming(self):
         if not self._queue:
@@ -134,8 +340,92 @@ class Queue:
     def length(self):
         return len(self._queue)
 
-    def add(self, *args):
+    @property
+    def tracks(self):
+        return self._queue[:]
+
+    def add(self, *args, dedupe=False):
+        if dedupe:
+            seen = set()
+            args = [
+                t for t in args
+                if not self._index[t.identifier] and not (t.identifier in seen or seen.add(t.identifier))
+            ]
+
+        for track in args:
+            render.remember(track)
+
         self._queue.extend(args)
+        self._index.update(t.identifier for t in args)
+        self.version += 1
+        return len(args)
+
+    def _forget(self, track):
+        if (count := self._index[track.identifier] - 1) > 0:
+            self._index[track.identifier] = count
+        else:
+            del self._index[track.identifier]
+
+    def _check_index(self, index):
+        if not self._queue:
+            raise QueueIsEmpty
+
+        if not 0 <= index <= len(self._queue) - 1:
+            raise InvalidQueueIndex
+
+    def remove(self, index):
+        self._check_index(index)
+
+        if index == self.position:
+            raise CurrentTrackLocked
+
+        track = self._queue.pop(index)
+        self._forget(track)
+        self.version += 1
+
+        if index < self.position:
+            self.position -= 1
+
+        return track
+
+    def move(self, src, dst):
+        self._check_index(src)
+        self._check_index(dst)
+
+        track = self._queue.pop(src)
+        self._queue.insert(dst, track)
+        self.version += 1
+
+        # Keep position pointing at the same track it did before the move.
+        if src == self.position:
+            self.position = dst
+        elif src < self.position <= dst:
+            self.position -= 1
+        elif dst <= self.position < src:
+            self.position += 1
+
+        return track
+
+    def dedupe(self):
+        if not self._queue:
+            raise QueueIsEmpty
+
+        if not any(count > 1 for count in self._index.values()):
+            return 0
+
+        # History and the current track are left alone; upcoming copies of anything earlier are dropped.
+        keep = self._queue[:self.position + 1]
+        seen = {t.identifier for t in keep}
+        for track in self._queue[self.position + 1:]:
+            if track.identifier not in seen:
+                seen.add(track.identifier)
+                keep.append(track)
+
+        removed = len(self._queue) - len(keep)
+        self._queue = keep
+        self._index = Counter(t.identifier for t in keep)
+        self.version += 1
+        return removed
 
     def get_next_track(self):
         if not self._queue:
@@ -161,6 +451,18 @@ class Queue:
         random.shuffle(upcoming)
         self._queue = self._queue[:self.position + 1]
         self._queue.extend(upcoming)
+        self.version += 1
+
+    def replace_current(self, track):
+        if not self._queue:
+            raise QueueIsEmpty
+
+        if self.position <= len(self._queue) - 1:
+            self._forget(self._queue[self.position])
+            self._queue[self.position] = track
+            self._index[track.identifier] += 1
+            self.version += 1
+            render.remember(track)
 
     def set_repeat_mode(self, mode):
         if mode == "none":
@@ -172,14 +474,125 @@ class Queue:
 
     def empty(self):
         self._queue.clear()
+        self._index.clear()
         self.position = 0
+        self.version += 1
+
+    def page(self, show):
+        if self._pages_key != (key := (self.version, self.position)):
+            self._pages = {}
+            self._pages_key = key
+
+        if show not in self._pages:
+            current = self.current_track
+            self._pages[show] = (
+                render.label(current) if current is not None else "No tracks currently playing.",
+                render.join_labels(self._queue[self.position + 1:self.position + 1 + show]),
+            )
+
+        return self._pages[show]
+
+
+class RadioPool:
+    def __init__(self, player, size=AUTOPLAY_POOL):
+        self.player = player
+        self.size = size
+        self.enabled = False
+        self._pool = deque()
+        self._seen = set()
+        self._refill = None
+
+    def __len__(self):
+        return len(self._pool)
+
+    def _take(self):
+        while self._pool:
+            if (track := self._pool.popleft()) not in self.player.queue:
+                return track
+
+    async def take(self):
+        if (track := self._take()) is None:
+            # Only reached if the pool was drained faster than it refills.
+            self.refill()
+            if self._refill is not None and not self._refill.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._refill), AUTOPLAY_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+            track = self._take()
+
+        self.refill()
+        return track
+
+    def put_back(self, track):
+        self._pool.appendleft(track)
+
+    def refill(self):
+        if self.enabled and len(self._pool) <= AUTOPLAY_LOW and (self._refill is None or self._refill.done()):
+            self._refill = asyncio.get_event_loop().create_task(self._fill())
+
+    def stop(self):
+        self.enabled = False
+        self._pool.clear()
+
+        if self._refill is not None:
+            self._refill.cancel()
+
+    def _seeds(self):
+        queue = self.player.queue
+        return queue.tracks[:queue.position + 1][-AUTOPLAY_SEEDS:][::-1]
+
+    async def _fill(self):
+        for seed in self._seeds():
+            if source_of(seed) == "youtube":
+                query = YOUTUBE_MIX_URL.format(seed.identifier)
+            else:
+                query = f"ytsearch:{seed.author}"
+
+            try:
+                tracks = await self.player.scheduler.get_tracks(
+                    query, priority=Priority.PREFETCH, guild_id=self.player.guild_id, node=self.player.node
+                )
+            except Exception:
+                log.exception("Autoplay lookup failed.", extra={"guild": self.player.guild_id})
+                continue
+
+            if isinstance(tracks, wavelink.TrackPlaylist):
+                tracks = tracks.tracks
+
+            for track in tracks or ():
+                if track.identifier not in self._seen and not track.is_stream and track not in self.player.queue:
+                    self._seen.add(track.identifier)
+                    self._pool.append(track)
+
+            if len(self._pool) >= self.size:
+                break
+
+        if len(self._seen) > 50 * self.size:
+            self._seen = {t.identifier for t in self._pool}
 
 
 class Player(wavelink.Player):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, health=None, prompts=None, scheduler=None, events=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.queue = Queue()
         self.eq_levels = [0.] * 15
+        self.health = health or SourceHealth()
+        self.prompts = prompts or PromptRegistry()
+        self.scheduler = scheduler
+        self.events = events
+        self.radio = RadioPool(self)
+        self.mailbox = Mailbox()
+        self._prepared = None
+        self._fallback = None
+        self._preparing = None
+        self._reset_recovery()
+
+    def _reset_recovery(self):
+        self._failed_position = None
+        self._failed_since = 0.
+        self._attempts = 0
+        self._tried = set()
 
     async def connect(self, ctx, channel=None):
         if self.is_connected:
@@ -192,6 +605,14 @@ class Player(wavelink.Player):
         return channel
 
     async def teardown(self):
+        self.mailbox.clear()
+        self.radio.stop()
+
+        if self._preparing is not None:
+            self._preparing[1].cancel()
+
+        self._prepared = self._fallback = None
+
         try:
             await self.destroy()
         except KeyError:
@@ -202,31 +623,29 @@ class Player(wavelink.Player):
             raise NoTracksFound
 
         if isinstance(tracks, wavelink.TrackPlaylist):
-            self.queue.add(*tracks.tracks)
+            self.queue.add(*tracks.tracks, dedupe=self.queue.auto_dedupe)
         elif len(tracks) == 1:
-            self.queue.add(tracks[0])
-            await ctx.send(f"**✅ Added {tracks[0].title} to the queue.**")
+            await self.add_track(ctx, tracks[0])
         else:
             if (track := await self.choose_track(ctx, tracks)) is not None:
-                self.queue.add(track)
-                await ctx.send(f"**✅ Added {track.title} to the queue.**")
+                await self.add_track(ctx, track)
 
         if not self.is_playing and not self.queue.is_empty:
-            await self.start_playback()
+            await self.mailbox.post(self.start_playback)
 
-    async def choose_track(self, ctx, tracks):
-        def _check(r, u):
-            return (
-                r.emoji in OPTIONS.keys()
-                and u == ctx.author
-                and r.message.id == msg.id
-            )
+    async def add_track(self, ctx, track):
+        if self.queue.auto_dedupe and track in self.queue:
+            raise AlreadyQueued
+
+        self.queue.add(track)
+        await ctx.send(f"**✅ Added {track.title} to the queue.**")
 
+    async def choose_track(self, ctx, tracks):
         embed = discord.Embed(
             title="▶ Choose a song",
             description=(
                 "\n".join(
-                    f"**{i+1}.** {t.title} ({t.length//60000}:{str(t.length%60).zfill(2)})"
+                    f"**{i+1}.** {render.remember(t)}"
                     for i, t in enumerate(tracks[:5])
                 )
             ),
@@ -237,56 +656,372 @@ class Player(wavelink.Player):
         embed.set_footer(text=f"Invoked by {ctx.author.display_name}", icon_url=ctx.author.avatar_url)
 
         msg = await ctx.send(embed=embed)
-        for emoji in list(OPTIONS.keys())[:min(len(tracks), len(OPTIONS))]:
-            await msg.add_reaction(emoji)
+        options = dict(list(OPTIONS.items())[:min(len(tracks), len(OPTIONS))])
+        # Opened before the reactions go on, so a pick made while they are still being added counts.
+        choice = self.prompts.open(msg.id, ctx.author.id, options, timeout=60.0)
 
         try:
-            reaction, _ = await self.bot.wait_for("reaction_add", timeout=60.0, check=_check)
+            for emoji in options:
+                if choice.done():
+                    break
+                await msg.add_reaction(emoji)
+
+            index = await choice
         except asyncio.TimeoutError:
             await msg.delete()
             await ctx.message.delete()
         else:
             await msg.delete()
-            return tracks[OPTIONS[reaction.emoji]]
+            return tracks[index]
+        finally:
+            self.prompts.close(msg.id)
 
     async def start_playback(self):
-        await self.play(self.queue.current_track)
+        # Re-checked here as another command may have started playback while this one was queued.
+        if not self.is_playing and (track := self.queue.current_track) is not None:
+            await self.play_track(track)
 
     async def advance(self):
+        self._reset_recovery()
+
         try:
             if (track := self.queue.get_next_track()) is not None:
-                await self.play(track)
+                await self.play_track(track)
+            elif self.radio.enabled and (track := await self.radio.take()) is not None:
+                # take() may have waited on a refill, during which a user can queue tracks of their own.
+                if (queued := self.queue.current_track) is not None:
+                    self.radio.put_back(track)
+                    track = queued
+                else:
+                    self.queue.add(track)
+                    self.queue.position = self.queue.length - 1
+
+                await self.play_track(track)
         except QueueIsEmpty:
             pass
 
     async def repeat_track(self):
-        await self.play(self.queue.current_track)
+        await self.play_track(self.queue.current_track)
+
+    async def jump(self, offset):
+        if self.queue.is_empty:
+            raise QueueIsEmpty
+
+        position = max(0, min(self.queue.position + offset, self.queue.length - 1))
+        if position == self.queue.position:
+            return position
+
+        # Merged skips land here as one jump, so each track passed over is counted once.
+        if self.events is not None:
+            for track in self.queue.tracks[self.queue.position:position]:
+                self.events.record(SKIP, self.guild_id, track)
+
+        return await self.jump_to(position)
+
+    async def jump_to(self, position):
+        if self.queue.is_empty:
+            raise QueueIsEmpty
+
+        if not 0 <= position <= self.queue.length - 1:
+            raise NoMoreTracks
+
+        self._reset_recovery()
+        self.queue.position = position
+        await self.play_track(self.queue.current_track)
+        return position
+
+    async def remove_track(self, index):
+        return self.queue.remove(index)
+
+    async def move_track(self, src, dst):
+        return self.queue.move(src, dst)
+
+    async def dedupe_queue(self):
+        return self.queue.dedupe()
+
+    async def stop_playback(self):
+        self._reset_recovery()
+        self.queue.empty()
+        await self.stop()
+
+    async def track_ended(self, reason, track):
+        # Ends for a track that is no longer current were already dealt with by a jump or recovery.
+        if self.queue.is_empty or track_id(track) != track_id(self.queue.current_track):
+            return
+
+        if reason == "LOAD_FAILED":
+            if self._failed_position != self.queue.position:
+                await self.recover(Failure.TRANSIENT, track)
+            return
+        elif reason == "FINISHED":
+            self.track_finished()
+
+        if self.queue.repeat_mode == RepeatMode.ONE:
+            await self.repeat_track()
+        else:
+            await self.advance()
+
+    async def play_track(self, track, **kwargs):
+        # Every track gets an alternative resolved in the background while the previous one played. Tracks
+        # from known-bad sources are swapped for it up front; otherwise it is kept as the fallback recovery
+        # switches to, so nothing here or there waits on a search.
+        if (prepared := self._prepared) is not None and prepared[0] == track.id:
+            self._prepared = None
+            if self.health.should_avoid(source_of(track)):
+                self.queue.replace_current(prepared[1])
+                track, self._fallback = prepared[1], None
+            else:
+                self._fallback = prepared
+        elif self._fallback is not None and self._fallback[0] != track.id:
+            self._fallback = None
+
+        await self.play(track, **kwargs)
+        self.radio.refill()
+        self.prepare_next()
+
+        if self.events is not None:
+            self.events.record(PLAY, self.guild_id, track)
+
+    def prepare_next(self):
+        if (track := self.queue.next_track) is None:
+            return
+
+        if self._prepared is not None and self._prepared[0] == track.id:
+            return
+
+        # A lookup still running for a track that is no longer next is dropped in favour of the new one.
+        if self._preparing is not None:
+            if self._preparing[0] == track.id and not self._preparing[1].done():
+                return
+            self._preparing[1].cancel()
+
+        self._preparing = (track.id, asyncio.get_event_loop().create_task(self._prepare(track)))
+
+    async def _prepare(self, track):
+        alternative = await self.find_alternative(
+            track, PREPARE_TIMEOUT, priority=Priority.PREFETCH, exclude={track.identifier}
+        )
+        if alternative is None:
+            return
+
+        # The track may have started while its alternative was still being looked up.
+        if not self.queue.is_empty and track_id(self.queue.current_track) == track.id:
+            self._fallback = (track.id, alternative)
+        else:
+            self._prepared = (track.id, alternative)
+
+    def _take_fallback(self, track):
+        fallback, self._fallback = self._fallback, None
+        if fallback is not None and fallback[0] == track.id and fallback[1].identifier not in self._tried:
+            self._tried.add(fallback[1].identifier)
+            return fallback[1]
+
+    def track_finished(self):
+        if (track := self.queue.current_track) is not None:
+            self.health.record_success(source_of(track))
+
+        self._reset_recovery()
+
+    async def recover(self, failure, failed):
+        if self.queue.is_empty or (track := self.queue.current_track) is None:
+            return
+
+        if track_id(failed) != track.id:
+            return
+
+        log.warning(
+            "Track %s failed (%s).", track.identifier, failure.name.lower(),
+            extra={"guild": self.guild_id, "node": self.node.identifier}
+        )
+
+        # One failure is counted per incident, not per retry or alternative tried for it.
+        if self._failed_position != self.queue.position:
+            self._reset_recovery()
+            self._failed_position = self.queue.position
+            self.health.record_failure(source_of(track))
+
+        self._attempts += 1
+        self._tried.add(track.identifier)
+
+        if self._attempts == 1 and failure.retryable:
+            await asyncio.sleep(RETRY_BACKOFF)
+            start = self.position if failure is Failure.STUCK else 0
+            return await self.play(track, start=int(start))
+
+        # The budget covers finding a replacement, so it starts once the retry is out of the way. The
+        # prefetched fallback is used straight away; a search is only the last resort.
+        if not self._failed_since:
+            self._failed_since = time.monotonic()
+
+        if (alternative := self._take_fallback(track)) is None:
+            if (remaining := RECOVERY_BUDGET - (time.monotonic() - self._failed_since)) <= 0:
+                return await self.advance()
+
+            alternative = await self.find_alternative(track, remaining)
+
+        if alternative is not None:
+            self.queue.replace_current(alternative)
+            return await self.play(alternative)
+
+        await self.advance()
+
+    async def find_alternative(self, track, timeout, priority=Priority.INTERACTIVE, exclude=None):
+        deadline = time.monotonic() + timeout
+        exclude = self._tried if exclude is None else exclude
+
+        for prefix in self.health.ranked_searches():
+            if (remaining := deadline - time.monotonic()) <= 0:
+                break
+
+            try:
+                tracks = await asyncio.wait_for(
+                    self.scheduler.get_tracks(
+                        f"{prefix}:{track.title}", priority=priority, guild_id=self.guild_id, node=self.node
+                    ),
+                    remaining
+                )
+            except asyncio.TimeoutError:
+                break
+            except Exception:
+                log.exception("Alternative lookup failed.", extra={"guild": self.guild_id, "node": self.node.identifier})
+                continue
+
+            if isinstance(tracks, wavelink.TrackPlaylist):
+                tracks = tracks.tracks
+
+            for candidate in tracks or ():
+                if candidate.identifier not in exclude and candidate.is_stream == track.is_stream:
+                    exclude.add(candidate.identifier)
+                    return candidate
+
+
+class _SkipReadyWait:
+    # Stands in for the bot while a Lavalink socket opens; everything but wait_until_ready is forwarded.
+    def __init__(self, bot):
+        self._bot = bot
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+    async def wait_until_ready(self):
+        pass
+
+
+class EagerWebSocket(wavelink.websocket.WebSocket):
+    # wavelink's _connect waits for gateway READY before the handshake, which only needs the user ID the
+    # node was built with. Only the first connect skips the wait; reconnects from _listen go through it.
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self._eager = True
+
+    async def _connect(self):
+        if not self._eager:
+            return await super()._connect()
+
+        self._eager = False
+        bot, self.bot = self.bot, _SkipReadyWait(self.bot)
+        try:
+            await super()._connect()
+        finally:
+            self.bot = bot
+
+
+def _add_offsets(old, new):
+    return (old[0] + new[0],)
 
 
 class Music(commands.Cog, wavelink.WavelinkMixin):
     def __init__(self, bot):
         self.bot = bot
         self.wavelink = wavelink.Client(bot=bot)
+        self.scheduler = RequestScheduler(self.wavelink)
+        self.source_health = SourceHealth()
+        self.prompts = PromptRegistry()
+        self.presence = VoicePresence()
+        self._playlists = None
+        self.events = EventLog()
+        self.events.start(self.bot.loop)
         self.bot.loop.create_task(self.start_nodes())
 
+        if self.bot.is_ready():
+            self.presence.seed(self.bot.guilds)
+
+    @property
+    def playlists(self):
+        # SQLite is only opened, and imported, the first time a playlist command is used.
+        if self._playlists is None:
+            from ..playlists import PlaylistStore
+            self._playlists = PlaylistStore()
+
+        return self._playlists
+
+    def cog_unload(self):
+        self.events.close()
+
+        if self._playlists is not None:
+            self._playlists.close()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.presence.seed(self.bot.guilds)
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        self.presence.seed(self.bot.guilds)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.presence.seed_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild):
+        self.presence.seed_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.presence.forget_guild(guild)
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        if not member.bot and after.channel is None:
-            if not [m for m in before.channel.members if not m.bot]:
-                await self.get_player(member.guild).teardown()
+        self.presence.update(member, before, after)
+
+        if member.bot or before.channel is None or before.channel == after.channel:
+            return
+
+        if self.presence.humans(before.channel.id):
+            return
+
+        # Only guilds the bot is already playing in are considered; get_player would create one.
+        if (player := self.find_player(member.guild.id)) is None or player.channel_id != before.channel.id:
+            return
+
+        # The running count can drift if an update was missed, so the member list has the final say.
+        if self.presence.recount(before.channel):
+            return
+
+        await player.teardown()
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        self.prompts.dispatch(payload.message_id, payload.user_id, str(payload.emoji))
 
     @wavelink.WavelinkMixin.listener()
     async def on_node_ready(self, node):
-        print(f" Wavelink node `{node.identifier}` ready.")
+        self.bot.startup.done("node", f"node {node.identifier} ready")
+        log.info("Wavelink node ready.", extra={"node": node.identifier})
 
     @wavelink.WavelinkMixin.listener("on_track_stuck")
-    @wavelink.WavelinkMixin.listener("on_track_end")
     @wavelink.WavelinkMixin.listener("on_track_exception")
+    async def on_player_failure(self, node, payload):
+        player = payload.player
+        await player.mailbox.post(player.recover, Failure.classify(payload), payload.track)
+
+    @wavelink.WavelinkMixin.listener("on_track_end")
     async def on_player_stop(self, node, payload):
-        if payload.player.queue.repeat_mode == RepeatMode.ONE:
-            await payload.player.repeat_track()
-        else:
-            await payload.player.advance()
+        # Replaced tracks were swapped out on purpose by a jump or the recovery pipeline.
+        if payload.reason != "REPLACED":
+            player = payload.player
+            await player.mailbox.post(player.track_ended, payload.reason, payload.track)
 
     async def cog_check(self, ctx):
         if isinstance(ctx.channel, discord.DMChannel):
@@ -296,7 +1031,11 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         return True
 
     async def start_nodes(self):
-        await self.bot.wait_until_ready()
+        # Lavalink only needs the bot's user ID, which the token already gives us, so nodes connect
+        # while the gateway is still logging in instead of after READY.
+        if (user_id := self.bot.user_id_hint) is None:
+            await self.bot.wait_until_ready()
+            user_id = self.bot.user.id
 
         nodes = {
             "MAIN": {
@@ -310,14 +1049,74 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
             }
         }
 
-        for node in nodes.values():
-            await self.wavelink.initiate_node(**node)
+        self.bot.startup.mark("node connect started")
+        results = await asyncio.gather(
+            *(self.initiate_node(user_id, **node) for node in nodes.values()), return_exceptions=True
+        )
+
+        for identifier, result in zip(nodes, results):
+            if isinstance(result, Exception):
+                log.error("Could not connect to Wavelink node: %s", result, extra={"node": identifier})
+
+    async def initiate_node(
+        self, user_id, *, host, port, rest_uri, password, identifier, region, secure=False, dumps=json.dumps
+    ):
+        # Same as wavelink.Client.initiate_node and Node.connect, minus their waits for READY. Voice updates
+        # still wait for it, since players are only made by commands.
+        if identifier in self.wavelink.nodes:
+            node = self.wavelink.nodes[identifier]
+            raise wavelink.errors.NodeOccupied(
+                f"Node with identifier ({identifier}) already exists >> {node.__repr__()}"
+            )
+
+        node = wavelink.Node(
+            host=host,
+            port=port,
+            shards=self.bot.shard_count or 1,
+            user_id=user_id,
+            rest_uri=rest_uri,
+            session=self.wavelink.session,
+            password=password,
+            region=region,
+            identifier=identifier,
+            secure=secure,
+            client=self.wavelink,
+            dumps=dumps,
+        )
+        node._websocket = EagerWebSocket(
+            node=node,
+            host=host,
+            port=port,
+            password=password,
+            shard_count=node.shards,
+            user_id=user_id,
+            secure=secure,
+            dumps=dumps,
+        )
+        await node._websocket._connect()
+
+        node.available = True
+        self.wavelink.nodes[identifier] = node
+        return node
+
+    def find_player(self, guild_id):
+        for node in self.wavelink.nodes.values():
+            if (player := node.players.get(guild_id)) is not None:
+                return player
 
     def get_player(self, obj):
+        # Only used when the player is first created; shared state every guild's player reads from.
+        shared = {
+            "health": self.source_health,
+            "prompts": self.prompts,
+            "scheduler": self.scheduler,
+            "events": self.events,
+        }
+
         if isinstance(obj, commands.Context):
-            return self.wavelink.get_player(obj.guild.id, cls=Player, context=obj)
+            return self.wavelink.get_player(obj.guild.id, cls=Player, context=obj, **shared)
         elif isinstance(obj, discord.Guild):
-            return self.wavelink.get_player(obj.id, cls=Player)
+            return self.wavelink.get_player(obj.id, cls=Player, **shared)
 
     @commands.command(name="join", aliases=["connect"])
     async def connect_command(self, ctx, *, channel: t.Optional[discord.VoiceChannel]):
@@ -355,9 +1154,11 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         else:
             query = query.strip("<>")
             if not re.match(URL_REGEX, query):
+                self.events.record(SEARCH, ctx.guild.id, query=query)
                 query = f"ytsearch:{query}"
 
-            await player.add_tracks(ctx, await self.wavelink.get_tracks(query))
+            tracks = await self.scheduler.get_tracks(query, priority=Priority.INTERACTIVE, guild_id=ctx.guild.id)
+            await player.add_tracks(ctx, tracks)
 
     @play_command.error
     async def play_command_error(self, ctx, exc):
@@ -365,6 +1166,8 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
             await ctx.send("**❎ No songs to play as the queue is empty.**")
         elif isinstance(exc, NoVoiceChannel):
             await ctx.send("**❎ No suitable voice channel was provided.**")
+        elif isinstance(exc, AlreadyQueued):
+            await ctx.send("**😥 That track is already in the queue.**")
 
     @commands.command(name="pause")
     async def pause_command(self, ctx):
@@ -384,8 +1187,7 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
     @commands.command(name="stop")
     async def stop_command(self, ctx):
         player = self.get_player(ctx)
-        player.queue.empty()
-        await player.stop()
+        await player.mailbox.post(player.stop_playback)
         await ctx.send("**⏹ Playback stopped.**")
 
     @commands.command(name="skip", aliases=["next"])
@@ -395,7 +1197,7 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         if not player.queue.upcoming:
             raise NoMoreTracks
 
-        await player.stop()
+        await player.mailbox.post(player.jump, 1, key="jump", merge=_add_offsets)
         await ctx.send("**⏭ Playing next track in queue.**")
 
     @next_command.error
@@ -412,8 +1214,7 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         if not player.queue.history:
             raise NoPreviousTracks
 
-        player.queue.position -= 2
-        await player.stop()
+        await player.mailbox.post(player.jump, -1, key="jump", merge=_add_offsets)
         await ctx.send("**⏮ Playing previous track in queue.**")
 
     @previous_command.error
@@ -434,6 +1235,23 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         if isinstance(exc, QueueIsEmpty):
             await ctx.send("**😥 The queue could not be shuffled as it is currently empty.**")
 
+    @commands.command(name="autoplay", aliases=["radio"])
+    async def autoplay_command(self, ctx):
+        player = self.get_player(ctx)
+
+        if player.radio.enabled:
+            player.radio.stop()
+            return await ctx.send("**📻 Autoplay is now off.**")
+
+        player.radio.enabled = True
+        if not player.queue.is_empty:
+            player.radio.refill()
+        await ctx.send("**📻 Autoplay is now on. Similar tracks will keep playing when the queue runs out.**")
+
+        # A queue that already ran out has no track left to end, so the radio is started here instead.
+        if not player.queue.is_empty and not player.is_playing and player.queue.current_track is None:
+            await player.mailbox.post(player.advance)
+
     @commands.command(name="loop")
     async def repeat_command(self, ctx, mode: str):
         if mode not in ("none", "1", "all"):
@@ -459,17 +1277,10 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         )
         embed.set_author(name="Query Results")
         embed.set_footer(text=f"Requested by {ctx.author.display_name}", icon_url=ctx.author.avatar_url)
-        embed.add_field(
-            name="Currently playing",
-            value=getattr(player.queue.current_track, "title", "No tracks currently playing."),
-            inline=False
-        )
-        if upcoming := player.queue.upcoming:
-            embed.add_field(
-                name="Next up",
-                value="\n".join(t.title for t in upcoming[:show]),
-                inline=False
-            )
+        current, upcoming = player.queue.page(show)
+        embed.add_field(name="Currently playing", value=current, inline=False)
+        if upcoming:
+            embed.add_field(name="Next up", value=upcoming, inline=False)
 
         msg = await ctx.send(embed=embed)
 
@@ -621,11 +1432,9 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         embed.add_field(name="Track title", value=player.queue.current_track.title, inline=False)
         embed.add_field(name="Artist", value=player.queue.current_track.author, inline=False)
 
-        position = divmod(player.position, 60000)
-        length = divmod(player.queue.current_track.length, 60000)
         embed.add_field(
             name="Position",
-            value=f"{int(position[0])}:{round(position[1]/1000):02}/{int(length[0])}:{round(length[1]/1000):02}",
+            value=f"{render.duration(player.position)}/{render.duration(player.queue.current_track.length)}",
             inline=False
         )
 
@@ -643,11 +1452,10 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         if player.queue.is_empty:
             raise QueueIsEmpty
 
-        if not 0 <= index <= player.queue.length:
+        if not 0 < index <= player.queue.length:
             raise NoMoreTracks
 
-        player.queue.position = index - 2
-        await player.stop()
+        await player.mailbox.post(player.jump_to, index - 1, key="jump_to")
         await ctx.send(f"**⏯ Playing track in position {index}.**")
 
     @skipto_command.error
@@ -657,6 +1465,51 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         elif isinstance(exc, NoMoreTracks):
             await ctx.send("**😥 That index is out of the bounds of the queue.**")
 
+    @commands.command(name="remove")
+    async def remove_command(self, ctx, index: int):
+        player = self.get_player(ctx)
+        track = await player.mailbox.post(player.remove_track, index - 1)
+        await ctx.send(f"**🗑 Removed {track.title} from the queue.**")
+
+    @remove_command.error
+    async def remove_command_error(self, ctx, exc):
+        if isinstance(exc, QueueIsEmpty):
+            await ctx.send("**😥 There are no tracks in the queue.**")
+        elif isinstance(exc, InvalidQueueIndex):
+            await ctx.send("**😥 That index is out of the bounds of the queue.**")
+        elif isinstance(exc, CurrentTrackLocked):
+            await ctx.send("**😥 The track that is currently playing can't be removed, skip it instead.**")
+
+    @commands.command(name="move")
+    async def move_command(self, ctx, src: int, dst: int):
+        player = self.get_player(ctx)
+        track = await player.mailbox.post(player.move_track, src - 1, dst - 1)
+        await ctx.send(f"**↕ Moved {track.title} to position {dst}.**")
+
+    @move_command.error
+    async def move_command_error(self, ctx, exc):
+        if isinstance(exc, QueueIsEmpty):
+            await ctx.send("**😥 There are no tracks in the queue.**")
+        elif isinstance(exc, InvalidQueueIndex):
+            await ctx.send("**😥 That index is out of the bounds of the queue.**")
+
+    @commands.group(name="dedupe", invoke_without_command=True)
+    async def dedupe_group(self, ctx):
+        player = self.get_player(ctx)
+        removed = await player.mailbox.post(player.dedupe_queue)
+        await ctx.send(f"**🧹 Removed {removed:,} duplicate tracks from the queue.**")
+
+    @dedupe_group.error
+    async def dedupe_group_error(self, ctx, exc):
+        if isinstance(exc, QueueIsEmpty):
+            await ctx.send("**😥 There are no tracks in the queue.**")
+
+    @dedupe_group.command(name="auto")
+    async def dedupe_auto_command(self, ctx):
+        player = self.get_player(ctx)
+        player.queue.auto_dedupe = not player.queue.auto_dedupe
+        await ctx.send(f"**✅ Automatic duplicate removal is now {'on' if player.queue.auto_dedupe else 'off'}.**")
+
     @commands.command(name="restart")
     async def restart_command(self, ctx):
         player = self.get_player(ctx)
@@ -690,8 +1543,114 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
         await player.seek(secs * 1000)
         await ctx.send("**✅ Seeked.**")
 
-    @commands.command(name="help")
-    async def help(self, ctx):
+    def playlist_owner(self, ctx, scope):
+        if scope == "me":
+            return "user", ctx.author.id
+        elif scope == "server":
+            return "guild", ctx.guild.id
+
+        raise InvalidPlaylistScope
+
+    @commands.group(name="playlist", aliases=["pl"], invoke_without_command=True)
+    async def playlist_group(self, ctx):
+        await ctx.send("**⚠ Use r!playlist save, r!playlist load or r!playlist list.**")
+
+    @playlist_group.command(name="save")
+    async def playlist_save_command(self, ctx, name: str, scope: t.Optional[str] = "me"):
+        player = self.get_player(ctx)
+
+        if player.queue.is_empty:
+            raise QueueIsEmpty
+
+        tracks = player.queue.tracks
+        await self.playlists.save(*self.playlist_owner(ctx, scope), name, tracks)
+        await ctx.send(f"**💾 Saved {len(tracks):,} tracks to the playlist {name}.**")
+
+    @playlist_save_command.error
+    async def playlist_save_command_error(self, ctx, exc):
+        if isinstance(exc, QueueIsEmpty):
+            await ctx.send("**😥 There is nothing to save as the queue is currently empty.**")
+        elif isinstance(exc, InvalidPlaylistScope):
+            await ctx.send("**⚠ A playlist can be saved for either 'me' or 'server'.**")
+
+    @playlist_group.command(name="load")
+    async def playlist_load_command(self, ctx, name: str):
+        player = self.get_player(ctx)
+
+        # The invoker's own playlist wins over a server playlist with the same name.
+        for scope in ("me", "server"):
+            if (tracks := await self.playlists.load(*self.playlist_owner(ctx, scope), name)) is not None:
+                break
+        else:
+            raise NoSuchPlaylist
+
+        if not player.is_connected:
+            await player.connect(ctx)
+
+        added = player.queue.add(*tracks, dedupe=player.queue.auto_dedupe)
+        await ctx.send(f"**✅ Added {added:,} tracks from the playlist {name} to the queue.**")
+
+        if not player.is_playing:
+            await player.mailbox.post(player.start_playback)
+
+    @playlist_load_command.error
+    async def playlist_load_command_error(self, ctx, exc):
+        if isinstance(exc, NoSuchPlaylist):
+            await ctx.send("**❎ There is no saved playlist with that name.**")
+        elif isinstance(exc, NoVoiceChannel):
+            await ctx.send("**❎ No suitable voice channel was provided.**")
+
+    @playlist_group.command(name="list")
+    async def playlist_list_command(self, ctx):
+        embed = discord.Embed(
+            title="Saved playlists",
+            colour=ctx.author.colour,
+            timestamp=dt.datetime.utcnow()
+        )
+        embed.set_author(name="Playlists")
+        embed.set_footer(text=f"Requested by {ctx.author.display_name}", icon_url=ctx.author.avatar_url)
+
+        for scope, title in (("me", "Your playlists"), ("server", "Server playlists")):
+            rows = await self.playlists.list(*self.playlist_owner(ctx, scope))
+            embed.add_field(
+                name=title,
+                value="\n".join(
+                    f"**{name}** ({count:,} tracks, {length//3600000}:{length//60000%60:02}:{length//1000%60:02})"
+                    for name, count, length in rows[:20]
+                ) or "No saved playlists.",
+                inline=False
+            )
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name="top")
+    async def top_command(self, ctx, show: t.Optional[int] = 10):
+        rows = await self.events.top_tracks(ctx.guild.id, max(1, min(show, 25)))
+
+        if not rows:
+            raise NoTracksFound
+
+        embed = discord.Embed(
+            title="Top tracks",
+            description="\n".join(
+                f"**{i+1}.** {title} ({plays:,} plays, {skips:,} skips)"
+                for i, (title, plays, skips) in enumerate(rows)
+            ),
+            colour=ctx.author.colour,
+            timestamp=dt.datetime.utcnow()
+        )
+        embed.set_author(name="Play History")
+        embed.set_footer(text=f"Requested by {ctx.author.display_name}", icon_url=ctx.author.avatar_url)
+        await ctx.send(embed=embed)
+
+    @top_command.error
+    async def top_command_error(self, ctx, exc):
+        if isinstance(exc, NoTracksFound):
+            await ctx.send("**😥 Nothing has been played in this server yet.**")
+
+    # Static embeds are built the first time they're asked for and the same object is sent from then on.
+    @functools.cached_property
+    def help_embed(self):
         embed = discord.Embed(
             title="Wellcome to RainyMusic™! This is our user guide!",
             description=(
@@ -707,8 +1666,7 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
                 + "**Good luck! ;D**\n"
                 + "**-------------------------[User Guide]-------------------------**\n"
             ),
-            colour=0x3B87F6,
-            timestamp=dt.datetime.utcnow()
+            colour=0x3B87F6
         )
         embed.set_author(name="RainyMusic™'s user guide", icon_url="https://cdn.discordapp.com/app-icons/933352277501161532/f52d7928fe342d2eef850d64bab1121d.png")
         embed.add_field(
@@ -822,23 +1780,66 @@ class Music(commands.Cog, wavelink.WavelinkMixin):
             value= "**Search for a track on YouTube**", 
             inline = False
             )
+
+        embed.add_field(
+            name = '___***Autoplay: r!autoplay***___', 
+            value= "**Toggle autoplay. Similar tracks keep playing when the queue runs out.**", 
+            inline = False
+            )
+
+        embed.add_field(
+            name = '___***Remove: r!remove + number***___', 
+            value= "**Remove the track at the given position from the queue.**", 
+            inline = False
+            )
+
+        embed.add_field(
+            name = '___***Move: r!move + number + number***___', 
+            value= "**Move a track in the queue to a new position.**", 
+            inline = False
+            )
+
+        embed.add_field(
+            name = '___***Dedupe: r!dedupe***___', 
+            value= "**Remove duplicate tracks from the queue.**\n**Use r!dedupe auto to skip duplicates when adding tracks.**", 
+            inline = False
+            )
+
+        embed.add_field(
+            name = '___***Top: r!top + number***___', 
+            value= "**Show the most played tracks in this server.**", 
+            inline = False
+            )
+
+        embed.add_field(
+            name = '___***Playlist: r!playlist + save/load/list + name***___', 
+            value= "**Save the queue as a playlist, load it back later or list your saved playlists.**\n**Add 'server' after the name to save it for the whole server.**", 
+            inline = False
+            )
         embed.set_footer(text=f"Help me ;-; This user guide is soo long ;-; And please don't copyrighted my bot ;-; XeonDex </>#0017")
 
-        msg = await ctx.send(embed=embed)
+        return embed
 
-    @commands.command(name="ミクダヨー", aliases=["mikudayo"])
-    async def mikudayo_command(self, ctx):
+    @functools.cached_property
+    def mikudayo_embed(self):
         embed = discord.Embed(
             title="Congratulations on finding easter egg #1, click the link to find out what it is.",
             description=(
                 "**https://www.youtube.com/watch?v=uX0QXQZdbuo**"
             ),
-            colour=0x1BD6EB,
-            timestamp=dt.datetime.utcnow()
+            colour=0x1BD6EB
         )
         embed.set_author(name="Easter Egg #1", icon_url="https://cdn.discordapp.com/app-icons/933352277501161532/f52d7928fe342d2eef850d64bab1121d.png")
 
-        msg = await ctx.send(embed=embed)
+        return embed
+
+    @commands.command(name="help")
+    async def help(self, ctx):
+        await ctx.send(embed=self.help_embed)
+
+    @commands.command(name="ミクダヨー", aliases=["mikudayo"])
+    async def mikudayo_command(self, ctx):
+        await ctx.send(embed=self.mikudayo_embed)
 
 def setup(bot):
     bot.add_cog(Music(bot))
@@ -0,0 +1,162 @@
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+LOG_PATH = "data/logs/rainymusic.log"
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 3
+BATCH_SIZE = 256
+FIELDS = ("guild", "command", "node")
+
+_STOP = object()
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        parts = [
+            f"ts={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+        ]
+        for field in FIELDS:
+            if (value := getattr(record, field, None)) is not None:
+                parts.append(f"{field}={_quote(value)}")
+        parts.append(f"msg={_quote(record.getMessage())}")
+
+        if record.exc_text:
+            parts.append(f"exc={_quote(record.exc_text)}")
+
+        return " ".join(parts)
+
+
+def _quote(value):
+    value = str(value)
+    if not value or any(c in value for c in ' "=\n'):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+    return value
+
+
+class RotatingWriter:
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, text):
+        # The limit is in bytes, and a file with nothing in it yet is kept however large the batch is.
+        if self.max_bytes and (size := self._file.tell()) and size + len(text.encode("utf-8")) > self.max_bytes:
+            self.rotate()
+
+        self._file.write(text)
+        self._file.flush()
+
+    def rotate(self):
+        self._file.close()
+
+        for i in range(self.backup_count - 1, 0, -1):
+            if (src := self.path.with_name(f"{self.path.name}.{i}")).exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+
+        if self.backup_count:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # Only resolve what can't safely be deferred; formatting happens on the writer thread.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class LogWriter(threading.Thread):
+    def __init__(self, records, sinks, formatter, batch_size=BATCH_SIZE):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.sinks = sinks
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self._failing = set()
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = _STOP in batch
+            if text := "".join(self.formatter.format(r) + "\n" for r in batch if r is not _STOP):
+                for sink in self.sinks:
+                    self._write(sink, text)
+
+            if stop:
+                break
+
+    # Logging can't report its own failures through logging, so a sink that starts failing gets one notice
+    # on stderr, and another once it recovers.
+    def _write(self, sink, text):
+        try:
+            sink.write(text)
+        except Exception as exc:
+            if sink not in self._failing:
+                self._failing.add(sink)
+                print(f"Could not write logs to {type(sink).__name__}: {exc!r}", file=sys.stderr, flush=True)
+        else:
+            if sink in self._failing:
+                self._failing.discard(sink)
+                print(f"Writing logs to {type(sink).__name__} again.", file=sys.stderr, flush=True)
+
+    def stop(self, timeout=5.0):
+        self.records.put(_STOP)
+        self.join(timeout)
+
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                sink.close()
+
+
+class _Stdout:
+    def write(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
+def setup_logging(path=LOG_PATH, level=logging.INFO, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    records = queue.SimpleQueue()
+    formatter = KeyValueFormatter()
+    formatter.converter = time.gmtime
+
+    writer = LogWriter(records, [_Stdout(), RotatingWriter(path, max_bytes, backup_count)], formatter)
+    writer.start()
+
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(records)]
+    root.setLevel(level)
+    logging.getLogger("discord").setLevel(logging.WARNING)
+    logging.getLogger("wavelink").setLevel(logging.WARNING)
+
+    return writer
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import wavelink
+
+DB_PATH = "data/playlists.sqlite3"
+INFO_KEYS = ("identifier", "title", "author", "length", "uri", "isStream", "isSeekable", "sourceName")
+
+
+def encode_tracks(tracks):
+    rows = [[t.id, {k: t.info[k] for k in INFO_KEYS if k in t.info}] for t in tracks]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_tracks(blob):
+    return [wavelink.Track(id_, info) for id_, info in json.loads(zlib.decompress(blob).decode("utf-8"))]
+
+
+class PlaylistStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._db = None
+        # A single worker keeps every query, and opening the database, on the thread that owns the connection.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playlists")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._db is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS playlists ("
+                "scope TEXT NOT NULL, owner_id INTEGER NOT NULL, name TEXT NOT NULL, "
+                "tracks BLOB NOT NULL, count INTEGER NOT NULL, length INTEGER NOT NULL, saved_at REAL NOT NULL, "
+                "PRIMARY KEY (scope, owner_id, name))"
+            )
+            self._db.commit()
+
+        return self._db
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _save(self, scope, owner_id, name, blob, count, length):
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (scope, owner_id, name.lower(), blob, count, length, time.time())
+        )
+        db.commit()
+
+    def _load(self, scope, owner_id, name):
+        row = self._connect().execute(
+            "SELECT tracks FROM playlists WHERE scope = ? AND owner_id = ? AND name = ?",
+            (scope, owner_id, name.lower())
+        ).fetchone()
+        return row and row[0]
+
+    def _list(self, scope, owner_id):
+        return self._connect().execute(
+            "SELECT name, count, length FROM playlists WHERE scope = ? AND owner_id = ? ORDER BY name",
+            (scope, owner_id)
+        ).fetchall()
+
+    async def save(self, scope, owner_id, name, tracks):
+        blob = encode_tracks(tracks)
+        # Lavalink reports a stream's length as 2**63 - 1, so streams are left out of the total.
+        length = sum(t.length for t in tracks if not t.is_stream)
+        await self._run(self._save, scope, owner_id, name, blob, len(tracks), length)
+
+    async def load(self, scope, owner_id, name):
+        if (blob := await self._run(self._load, scope, owner_id, name)) is not None:
+            return decode_tracks(blob)
+
+    async def list(self, scope, owner_id):
+        return await self._run(self._list, scope, owner_id)
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,75 @@
+import asyncio
+import heapq
+import time
+
+
+class Prompt:
+    __slots__ = ("user_id", "options", "future", "expires")
+
+    def __init__(self, user_id, options, future, expires):
+        self.user_id = user_id
+        self.options = options
+        self.future = future
+        self.expires = expires
+
+
+# Reactions are routed straight to the prompt for their message, and every prompt is expired by a
+# single sweeper task sleeping until the earliest deadline, instead of one wait_for check per prompt.
+class PromptRegistry:
+    def __init__(self):
+        self._prompts = {}
+        self._deadlines = []
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._prompts)
+
+    def open(self, message_id, user_id, options, timeout):
+        loop = asyncio.get_event_loop()
+        expires = time.monotonic() + timeout
+        self._prompts[message_id] = Prompt(user_id, options, loop.create_future(), expires)
+        earliest = not self._deadlines or expires < self._deadlines[0][0]
+        heapq.heappush(self._deadlines, (expires, message_id))
+
+        # A sweeper already asleep only wakes for the deadline it saw, so it is restarted for an earlier one.
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = loop.create_task(self._sweep())
+        elif earliest:
+            self._sweeper.cancel()
+            self._sweeper = loop.create_task(self._sweep())
+
+        return self._prompts[message_id].future
+
+    def close(self, message_id):
+        if (prompt := self._prompts.pop(message_id, None)) is not None and not prompt.future.done():
+            prompt.future.cancel()
+
+    def dispatch(self, message_id, user_id, emoji):
+        if (prompt := self._prompts.get(message_id)) is None:
+            return False
+
+        if user_id != prompt.user_id or emoji not in prompt.options:
+            return False
+
+        del self._prompts[message_id]
+        if not prompt.future.done():
+            prompt.future.set_result(prompt.options[emoji])
+
+        return True
+
+    async def _sweep(self):
+        while self._deadlines:
+            expires, message_id = self._deadlines[0]
+
+            if (delay := expires - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._deadlines)
+            prompt = self._prompts.get(message_id)
+
+            # The id may have been answered, or reused by a newer prompt with a later deadline.
+            if prompt is not None and prompt.expires <= expires:
+                del self._prompts[message_id]
+                if not prompt.future.done():
+                    prompt.future.set_exception(asyncio.TimeoutError())
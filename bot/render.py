@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+MAX_LABELS = 20000
+FIELD_LIMIT = 1024
+
+# Display strings are worked out once per track, when it's queued, and reused by every embed it shows up in.
+_labels = OrderedDict()
+
+
+def duration(ms):
+    minutes, seconds = divmod(int(ms) // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+
+    return f"{minutes}:{seconds:02}"
+
+
+def remember(track):
+    if track.id in _labels:
+        _labels.move_to_end(track.id)
+        return _labels[track.id]
+
+    if track.is_stream:
+        label = f"{track.title} (live)"
+    else:
+        label = f"{track.title} ({duration(track.length)})"
+
+    _labels[track.id] = label
+    if len(_labels) > MAX_LABELS:
+        _labels.popitem(last=False)
+
+    return label
+
+
+def label(track):
+    return _labels.get(track.id) or remember(track)
+
+
+def join_labels(tracks, limit=FIELD_LIMIT):
+    lines, size = [], 0
+
+    for track in tracks:
+        line = label(track)
+        if size + len(line) + 1 > limit:
+            break
+
+        lines.append(line)
+        size += len(line) + 1
+
+    return "\n".join(lines)
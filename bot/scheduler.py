@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+
+log = logging.getLogger(__name__)
+
+CONCURRENCY = 4
+TARGET_LATENCY = 1.5
+MAX_BACKOFF = 5.0
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    PREFETCH = 1
+    BULK = 2
+
+
+class _Request:
+    __slots__ = ("node", "query", "future")
+
+    def __init__(self, node, query, future):
+        self.node = node
+        self.query = query
+        self.future = future
+
+
+class _Lane:
+    def __init__(self, identifier, limit, target_latency):
+        self.identifier = identifier
+        self.limit = limit
+        self.max_limit = limit
+        self.target_latency = target_latency
+        self.active = 0
+        self.latency = None
+        self.successes = 0
+        self.backoff_until = 0.
+        self.timer = None
+        self.pending = {p: OrderedDict() for p in Priority}
+
+    def push(self, priority, guild_id, request):
+        self.pending[priority].setdefault(guild_id, deque()).append(request)
+
+    def pop(self, now):
+        for priority, guilds in self.pending.items():
+            # Interactive requests get one slot of headroom and ignore backoff, so they never queue behind bulk work.
+            if priority is Priority.INTERACTIVE:
+                if self.active >= self.limit + 1:
+                    return None
+            elif self.active >= self.limit or now < self.backoff_until:
+                continue
+
+            # Guilds take turns within a priority class, one request each.
+            while guilds:
+                guild_id, requests = guilds.popitem(last=False)
+                request = requests.popleft()
+                if requests:
+                    guilds[guild_id] = requests
+
+                if not request.future.done():
+                    self.active += 1
+                    return request
+
+    def observe(self, elapsed, now):
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+
+        if self.latency > self.target_latency:
+            if now >= self.backoff_until:
+                self.limit = max(1, self.limit // 2)
+                self.backoff_until = now + min(self.latency, MAX_BACKOFF)
+                self.successes = 0
+                log.warning(
+                    "Lavalink REST is slow (%.2fs), limiting to %d requests.", self.latency, self.limit,
+                    extra={"node": self.identifier}
+                )
+        elif self.limit < self.max_limit:
+            self.successes += 1
+            if self.successes >= self.limit:
+                self.limit += 1
+                self.successes = 0
+
+    @property
+    def next_wakeup(self):
+        if any(self.pending[p] for p in Priority if p is not Priority.INTERACTIVE):
+            return self.backoff_until
+
+
+class RequestScheduler:
+    def __init__(self, client, concurrency=CONCURRENCY, target_latency=TARGET_LATENCY):
+        self.client = client
+        self.concurrency = concurrency
+        self.target_latency = target_latency
+        self._lanes = {}
+
+    def _lane(self, node):
+        if node.identifier not in self._lanes:
+            self._lanes[node.identifier] = _Lane(node.identifier, self.concurrency, self.target_latency)
+
+        return self._lanes[node.identifier]
+
+    async def get_tracks(self, query, *, priority=Priority.INTERACTIVE, guild_id=None, node=None):
+        if (node := node or self.client.get_best_node()) is None:
+            return await self.client.get_tracks(query)
+
+        lane = self._lane(node)
+        future = asyncio.get_event_loop().create_future()
+        lane.push(priority, guild_id, _Request(node, query, future))
+        self._pump(lane)
+
+        return await future
+
+    def _pump(self, lane):
+        now = time.monotonic()
+
+        while (request := lane.pop(now)) is not None:
+            asyncio.get_event_loop().create_task(self._execute(lane, request))
+
+        if lane.timer is None and (wakeup := lane.next_wakeup) is not None and wakeup > now:
+            lane.timer = asyncio.get_event_loop().call_later(wakeup - now, self._wake, lane)
+
+    def _wake(self, lane):
+        lane.timer = None
+        self._pump(lane)
+
+    async def _execute(self, lane, request):
+        started = time.monotonic()
+
+        try:
+            result = await request.node.get_tracks(request.query)
+        except Exception as exc:
+            if not request.future.done():
+                request.future.set_exception(exc)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            lane.active -= 1
+            lane.observe(time.monotonic() - started, time.monotonic())
+            self._pump(lane)
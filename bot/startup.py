@@ -0,0 +1,41 @@
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self, *required):
+        self.started = time.perf_counter()
+        self.reported = False
+        self._last = self.started
+        self._marks = []
+        self._required = set(required)
+
+    def mark(self, name):
+        if self.reported:
+            return
+
+        now = time.perf_counter()
+        self._marks.append((name, now - self._last, now - self.started))
+        self._last = now
+
+    # Called as each component needed for playback comes up; the report goes out once all of them have.
+    def done(self, component, name=None):
+        if self.reported or component not in self._required:
+            return
+
+        self.mark(name or f"{component} ready")
+        self._required.discard(component)
+
+        if not self._required:
+            self.mark("first playable")
+            self.report()
+
+    def report(self):
+        self.reported = True
+
+        for name, delta, total in self._marks:
+            log.info("Startup: %s +%.0f ms (at %.0f ms).", name, delta * 1000, total * 1000)
+
+        log.info("Startup: time to first playable %.0f ms.", self._marks[-1][2] * 1000)